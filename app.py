@@ -1,20 +1,55 @@
 from __future__ import annotations
 
 from pathlib import Path
-from copy import deepcopy
-from datetime import datetime
+from collections import defaultdict, deque
+import atexit
 import math
+import mmap
 import os
+import re
+import threading
 import time
-import json
-from typing import Any, Dict, List, Optional, Tuple
-
-from flask import Flask, jsonify, render_template, request
+import uuid
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple, Union
+
+from flask import (
+    Flask,
+    Response,
+    g,
+    jsonify,
+    render_template,
+    request,
+    stream_with_context,
+)
+from flask.json.provider import JSONProvider
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from numba import njit
+except ImportError:  # pragma: no cover - numba is optional
+
+    def njit(*args: Any, **kwargs: Any) -> Callable[[Any], Any]:
+        def decorator(func: Any) -> Any:
+            return func
+
+        return decorator
 
 ROOT = Path(__file__).parent
 CONTROLS_PATH = ROOT / "controls.json"
 STATE_PATH = ROOT / "state.json"
+PROFILE_DIR = ROOT / "profiles"
+STATE_FLUSH_DELAY = 0.2
+STATE_FLUSH_MAX_BACKOFF = 30.0
+MMAP_JSON_MIN_BYTES = 1 << 20
+_STATE_DIRTY = threading.Event()
+STATE_LOCK = threading.Lock()
+_STATE_FLUSH_LOCK = threading.Lock()
+
+PathParts = Tuple[Tuple[str, ...], str]
+Normalizer = Callable[[Any], Any]
+Converter = Callable[[Any], Any]
 
 DEFAULT_STATE: Dict[str, Any] = {
     "units": {"system": "metric"},
@@ -33,6 +68,7 @@ DEFAULT_STATE: Dict[str, Any] = {
         "local_game": "Elden Ring",
     },
 }
+DEFAULT_STATE_JSON = orjson.dumps(DEFAULT_STATE)
 
 
 def get_api_key() -> Optional[str]:
@@ -52,19 +88,75 @@ def authorize_request() -> bool:
     return False
 
 
+def read_json_payload() -> Dict[str, Any]:
+    if not request.is_json:
+        return {}
+    try:
+        payload = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        return {}
+    if not isinstance(payload, dict):
+        return {}
+    return payload
+
+
 def unauthorized_response():
     return jsonify({"error": "Unauthorized"}), 401
 
 
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj), mimetype="application/json"
+        )
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 ASSISTANT_MAX_HISTORY = 10
 GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-3-flash-preview")
 LLM_RATE_LIMIT_RPM = int(os.environ.get("LLM_RATE_LIMIT_RPM", "5"))
 LLM_RATE_LIMIT_WINDOW = 60.0
-LLM_REQUEST_LOG: Dict[str, List[float]] = {}
+LLM_RATE_LIMIT_MAX_CLIENTS = 1024
+LLM_REQUEST_LOG: Dict[str, Deque[float]] = defaultdict(deque)
+LLM_REQUEST_LOG_LOCK = threading.Lock()
+REDIS_URL = os.environ.get("REDIS_URL")
+REDIS_RATE_LIMIT_PREFIX = "llm_rate_limit:"
+REDIS_RATE_LIMIT_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+local count = redis.call('ZCARD', key)
+if count >= limit then
+  return {0, redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')[2]}
+end
+redis.call('ZADD', key, now, ARGV[4])
+redis.call('EXPIRE', key, math.ceil(window))
+return {1, '0'}
+"""
+REDIS_SOCKET_TIMEOUT = 0.5
+_REDIS_UNAVAILABLE = object()
+_REDIS_RATE_LIMITER: Any = None
+_REDIS_FALLBACK_LOGGED = False
+_PROMPT_CACHE: Dict[Tuple[int, int], str] = {}
+_STATE_VERSION = 0
+_STATE_JSON_CACHE: Tuple[int, bytes] = (-1, b"")
+_PROCESS_TAG = uuid.uuid4().hex[:8]
 DEFAULT_GEMINI_ENDPOINT = (
     "https://generativelanguage.googleapis.com/v1beta/models"
 )
+GEMINI_SESSION = requests.Session()
+GEMINI_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=32))
+GEMINI_SESSION.headers.update({"Content-Type": "application/json"})
 ASSISTANT_PROMPT_CONFIG = {
     "role": "You are an in-car assistant for a simulated vehicle.",
     "goals": [
@@ -92,15 +184,28 @@ ASSISTANT_PROMPT_CONFIG = {
 
 def read_json(path: Path, default: Any) -> Any:
     try:
-        return json.loads(path.read_text())
+        with path.open("rb") as handle:
+            if os.fstat(handle.fileno()).st_size < MMAP_JSON_MIN_BYTES:
+                return orjson.loads(handle.read())
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    return orjson.loads(view)
     except FileNotFoundError:
         return default
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         return default
 
 
 def write_json(path: Path, data: Any) -> None:
-    path.write_text(json.dumps(data, indent=2) + "\n")
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_bytes(
+        orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE)
+    )
+    os.replace(tmp_path, path)
+
+
+def dump_json_text(data: Any) -> str:
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
 
 
 def load_controls() -> Dict[str, Any]:
@@ -110,39 +215,170 @@ def load_controls() -> Dict[str, Any]:
     return data
 
 
-def refresh_controls() -> None:
-    global CONTROLS, CONTROL_MAP
-    CONTROLS = load_controls()
-    CONTROL_MAP = build_control_map(CONTROLS)
+def get_controls_stamp() -> Optional[Tuple[int, int]]:
+    try:
+        stat = CONTROLS_PATH.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
 
 
-def merge_state(default: Any, current: Any) -> Any:
-    if isinstance(default, dict):
-        if not isinstance(current, dict):
-            return deepcopy(default)
-        merged: Dict[str, Any] = {}
-        for key, default_value in default.items():
-            if key in current:
-                merged[key] = merge_state(default_value, current[key])
-            else:
-                merged[key] = deepcopy(default_value)
-        for key, value in current.items():
-            if key not in merged:
-                merged[key] = value
-        return merged
-    if current is None:
-        return deepcopy(default)
-    return current
+def get_controls_etag(stamp: Optional[Tuple[int, int]]) -> str:
+    if stamp is None:
+        return "controls-missing"
+    mtime_ns, size = stamp
+    return f"{mtime_ns:x}-{size:x}"
+
+
+class ControlRegistry:
+    __slots__ = (
+        "stamp",
+        "controls",
+        "controls_json",
+        "etag",
+        "specs",
+        "mapped_paths",
+        "prompt_prefix",
+    )
+
+    def __init__(self, stamp: Optional[Tuple[int, int]]) -> None:
+        self.stamp = stamp
+        self.controls = load_controls()
+        self.controls_json = orjson.dumps(self.controls)
+        self.etag = get_controls_etag(stamp)
+        control_map = build_control_map(self.controls)
+        self.specs = {
+            path: ControlSpec(path, control) for path, control in control_map.items()
+        }
+        self.mapped_paths = build_mapped_path_parts(control_map)
+        self.prompt_prefix = build_assistant_prompt_prefix(self.controls)
+
+
+def refresh_controls() -> ControlRegistry:
+    global CONTROL_REGISTRY
+    registry = CONTROL_REGISTRY
+    stamp = get_controls_stamp()
+    if stamp != registry.stamp:
+        registry = CONTROL_REGISTRY = ControlRegistry(stamp)
+        _PROMPT_CACHE.clear()
+    return registry
+
+
+def get_state_json() -> bytes:
+    global _STATE_JSON_CACHE
+    version, body = _STATE_JSON_CACHE
+    if version != _STATE_VERSION:
+        version = _STATE_VERSION
+        body = orjson.dumps(STATE)
+        _STATE_JSON_CACHE = (version, body)
+    return body
+
+
+def get_state_etag() -> str:
+    return f"{_PROCESS_TAG}-{_STATE_VERSION}"
+
+
+def json_response_with_etag(data: Any, etag: str) -> Response:
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        body = data if isinstance(data, bytes) else orjson.dumps(data)
+        response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def mark_state_changed() -> None:
+    global _STATE_VERSION
+    _STATE_VERSION += 1
+    _STATE_DIRTY.set()
+
+
+def flush_state() -> None:
+    with _STATE_FLUSH_LOCK:
+        if not _STATE_DIRTY.is_set():
+            return
+        _STATE_DIRTY.clear()
+        write_json(STATE_PATH, STATE)
+
+
+def run_state_flusher() -> None:
+    retry_delay = 0.0
+    while True:
+        _STATE_DIRTY.wait()
+        time.sleep(STATE_FLUSH_DELAY + retry_delay)
+        try:
+            flush_state()
+        except Exception:
+            if not retry_delay:
+                app.logger.exception("Failed to write %s; retrying", STATE_PATH)
+            retry_delay = min(
+                max(retry_delay * 2, STATE_FLUSH_DELAY), STATE_FLUSH_MAX_BACKOFF
+            )
+            _STATE_DIRTY.set()
+        else:
+            if retry_delay:
+                app.logger.info("Wrote %s after earlier failures", STATE_PATH)
+            retry_delay = 0.0
+
+
+def iter_default_leaves(
+    default: Dict[str, Any]
+) -> Iterator[Tuple[Tuple[str, ...], Any]]:
+    stack: List[Tuple[Tuple[str, ...], Iterator[Tuple[str, Any]]]] = [
+        ((), iter(default.items()))
+    ]
+    while stack:
+        prefix, items = stack[-1]
+        for key, value in items:
+            if isinstance(value, dict):
+                stack.append((prefix + (key,), iter(value.items())))
+                break
+            yield prefix + (key,), value
+        else:
+            stack.pop()
+
+
+DEFAULT_STATE_LEAVES: List[Tuple[Tuple[str, ...], Any]] = list(
+    iter_default_leaves(DEFAULT_STATE)
+)
+
+
+def copy_dict_tree(tree: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: copy_dict_tree(value) if type(value) is dict else value
+        for key, value in tree.items()
+    }
+
+
+def merge_state(state: Dict[str, Any]) -> bool:
+    changed = False
+    for parts, leaf in DEFAULT_STATE_LEAVES:
+        current = state
+        for part in parts[:-1]:
+            child = current.get(part)
+            if not isinstance(child, dict):
+                child = current[part] = {}
+                changed = True
+            current = child
+        if current.get(parts[-1]) is None:
+            current[parts[-1]] = leaf
+            changed = True
+    return changed
 
 
 def load_state() -> Dict[str, Any]:
-    data = read_json(STATE_PATH, DEFAULT_STATE)
+    data = read_json(STATE_PATH, {})
     if not isinstance(data, dict):
         data = {}
-    merged = merge_state(DEFAULT_STATE, data)
-    if merged != data:
-        write_json(STATE_PATH, merged)
-    return merged
+    changed = merge_state(data)
+    changed = (
+        prune_mapped_state_entries(data, CONTROL_REGISTRY.mapped_paths) or changed
+    )
+    if changed:
+        write_json(STATE_PATH, data)
+    return data
 
 
 def build_control_map(controls: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
@@ -154,6 +390,21 @@ def build_control_map(controls: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
     return mapping
 
 
+def split_path(path: str) -> PathParts:
+    *parents, key = path.split(".")
+    return tuple(parents), key
+
+
+def build_mapped_path_parts(
+    control_map: Dict[str, Dict[str, Any]]
+) -> List[PathParts]:
+    return [
+        split_path(path)
+        for path, control in control_map.items()
+        if control.get("maps_to")
+    ]
+
+
 def get_google_api_key() -> Optional[str]:
     return os.environ.get("GEMINI_API_KEY")
 
@@ -165,50 +416,125 @@ def get_client_id() -> str:
     return request.remote_addr or "unknown"
 
 
+def prune_rate_limit_log(window_start: float) -> None:
+    stale = [
+        client_id
+        for client_id, timestamps in LLM_REQUEST_LOG.items()
+        if not timestamps or timestamps[-1] < window_start
+    ]
+    for client_id in stale:
+        del LLM_REQUEST_LOG[client_id]
+
+
+def get_redis_rate_limiter() -> Any:
+    global _REDIS_RATE_LIMITER
+    if not REDIS_URL:
+        return None
+    if _REDIS_RATE_LIMITER is None:
+        try:
+            import redis
+        except ImportError:
+            app.logger.warning(
+                "REDIS_URL is set but redis is not installed; "
+                "using in-process rate limiting."
+            )
+            _REDIS_RATE_LIMITER = _REDIS_UNAVAILABLE
+            return None
+        client = redis.Redis.from_url(
+            REDIS_URL,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+        )
+        _REDIS_RATE_LIMITER = client.register_script(REDIS_RATE_LIMIT_SCRIPT)
+    if _REDIS_RATE_LIMITER is _REDIS_UNAVAILABLE:
+        return None
+    return _REDIS_RATE_LIMITER
+
+
+def check_rate_limit_redis(
+    limiter: Any, client_id: str, now: float
+) -> Tuple[bool, int]:
+    allowed, oldest = limiter(
+        keys=[f"{REDIS_RATE_LIMIT_PREFIX}{client_id}"],
+        args=[
+            now,
+            LLM_RATE_LIMIT_WINDOW,
+            LLM_RATE_LIMIT_RPM,
+            f"{now}:{uuid.uuid4().hex}",
+        ],
+    )
+    if int(allowed):
+        return True, 0
+    retry_after = int(math.ceil(LLM_RATE_LIMIT_WINDOW - (now - float(oldest))))
+    return False, max(retry_after, 1)
+
+
 def check_rate_limit(client_id: str) -> Tuple[bool, int]:
+    global _REDIS_FALLBACK_LOGGED
     if LLM_RATE_LIMIT_RPM <= 0:
         return True, 0
     now = time.time()
+    limiter = get_redis_rate_limiter()
+    if limiter is not None:
+        try:
+            result = check_rate_limit_redis(limiter, client_id, now)
+        except Exception:  # pragma: no cover - network bound
+            if not _REDIS_FALLBACK_LOGGED:
+                _REDIS_FALLBACK_LOGGED = True
+                app.logger.exception(
+                    "Redis rate limiting failed; using in-process fallback."
+                )
+        else:
+            _REDIS_FALLBACK_LOGGED = False
+            return result
     window_start = now - LLM_RATE_LIMIT_WINDOW
-    timestamps = [ts for ts in LLM_REQUEST_LOG.get(client_id, []) if ts >= window_start]
-    if len(timestamps) >= LLM_RATE_LIMIT_RPM:
-        retry_after = int(math.ceil(LLM_RATE_LIMIT_WINDOW - (now - min(timestamps))))
-        LLM_REQUEST_LOG[client_id] = timestamps
-        return False, max(retry_after, 1)
-    timestamps.append(now)
-    LLM_REQUEST_LOG[client_id] = timestamps
+    with LLM_REQUEST_LOG_LOCK:
+        if len(LLM_REQUEST_LOG) > LLM_RATE_LIMIT_MAX_CLIENTS:
+            prune_rate_limit_log(window_start)
+        timestamps = LLM_REQUEST_LOG[client_id]
+        while timestamps and timestamps[0] < window_start:
+            timestamps.popleft()
+        if len(timestamps) >= LLM_RATE_LIMIT_RPM:
+            retry_after = int(
+                math.ceil(LLM_RATE_LIMIT_WINDOW - (now - timestamps[0]))
+            )
+            return False, max(retry_after, 1)
+        timestamps.append(now)
     return True, 0
 
 
+CONTROL_SUMMARY_KEYS = (
+    "id",
+    "label",
+    "group",
+    "module",
+    "path",
+    "type",
+    "value_type",
+    "values",
+    "min",
+    "max",
+    "step",
+    "units",
+    "maps_to",
+    "conversion",
+    "visible_when",
+    "description",
+)
+
+
 def summarize_controls(controls: Dict[str, Any]) -> List[Dict[str, Any]]:
-    summarized: List[Dict[str, Any]] = []
-    for control in controls.get("controls", []):
-        summarized.append(
-            {
-                "id": control.get("id"),
-                "label": control.get("label"),
-                "group": control.get("group"),
-                "module": control.get("module"),
-                "path": control.get("path"),
-                "type": control.get("type"),
-                "value_type": control.get("value_type"),
-                "values": control.get("values"),
-                "min": control.get("min"),
-                "max": control.get("max"),
-                "step": control.get("step"),
-                "units": control.get("units"),
-                "maps_to": control.get("maps_to"),
-                "conversion": control.get("conversion"),
-                "visible_when": control.get("visible_when"),
-                "description": control.get("description"),
-            }
-        )
-    return summarized
+    return [
+        {
+            key: value
+            for key in CONTROL_SUMMARY_KEYS
+            if (value := control.get(key)) is not None
+        }
+        for control in controls.get("controls", [])
+    ]
 
 
-def build_assistant_system_prompt(
-    controls: Dict[str, Any], state: Dict[str, Any]
-) -> str:
+def build_assistant_prompt_prefix(controls: Dict[str, Any]) -> str:
     control_summary = summarize_controls(controls)
     config = ASSISTANT_PROMPT_CONFIG
     sections: List[str] = []
@@ -230,11 +556,24 @@ def build_assistant_system_prompt(
         sections.append(
             "Output notes:\n" + "\n".join(f"- {note}" for note in output_notes)
         )
-    sections.append(f"Controls:\n{json.dumps(control_summary, indent=2)}")
-    sections.append(f"Current state:\n{json.dumps(state, indent=2)}")
+    sections.append(f"Controls:\n{orjson.dumps(control_summary).decode()}")
     return "\n\n".join(sections)
 
 
+def build_assistant_system_prompt(
+    registry: ControlRegistry, state: Dict[str, Any]
+) -> str:
+    cache_key = (id(registry), _STATE_VERSION)
+    cached = _PROMPT_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    state_text = dump_json_text(state)
+    prompt = f"{registry.prompt_prefix}\n\nCurrent state:\n{state_text}"
+    _PROMPT_CACHE.clear()
+    _PROMPT_CACHE[cache_key] = prompt
+    return prompt
+
+
 def normalize_history(history: Any) -> List[Dict[str, str]]:
     if not isinstance(history, list):
         return []
@@ -280,6 +619,19 @@ def build_azure_messages(
     return messages
 
 
+def build_google_payload(
+    history: List[Dict[str, str]], message: str, system_prompt: str
+) -> Dict[str, Any]:
+    return {
+        "contents": build_google_contents(history, message),
+        "systemInstruction": {"parts": [{"text": system_prompt}]},
+        "generationConfig": {
+            "temperature": 0.4,
+            "responseMimeType": "application/json",
+        },
+    }
+
+
 def call_google_gemini(
     message: str,
     history: List[Dict[str, str]],
@@ -295,18 +647,11 @@ def call_google_gemini(
 
     endpoint = os.environ.get("GEMINI_API_ENDPOINT", DEFAULT_GEMINI_ENDPOINT)
     url = f"{endpoint}/{GEMINI_MODEL}:generateContent"
-    payload = {
-        "contents": build_google_contents(history, message),
-        "systemInstruction": {"parts": [{"text": system_prompt}]},
-        "generationConfig": {
-            "temperature": 0.4,
-            "responseMimeType": "application/json",
-        },
-    }
+    payload = build_google_payload(history, message, system_prompt)
     try:
-        response = requests.post(
+        response = GEMINI_SESSION.post(
             url,
-            headers={"Content-Type": "application/json", "X-goog-api-key": api_key},
+            headers={"X-goog-api-key": api_key},
             json=payload,
             timeout=30,
         )
@@ -322,6 +667,54 @@ def call_google_gemini(
         return None, "Gemini response was missing text content."
 
 
+def iter_gemini_stream(response: requests.Response) -> Iterator[str]:
+    with response:
+        for line in response.iter_lines():
+            if not line.startswith(b"data:"):
+                continue
+            try:
+                chunk = orjson.loads(line[5:])
+            except orjson.JSONDecodeError:
+                continue
+            try:
+                text = chunk["candidates"][0]["content"]["parts"][0]["text"]
+            except (KeyError, IndexError, TypeError):
+                continue
+            if text:
+                yield text
+
+
+def stream_google_gemini(
+    message: str,
+    history: List[Dict[str, str]],
+    system_prompt: str,
+    api_key_override: Optional[str] = None,
+) -> Tuple[Optional[Iterator[str]], Optional[str]]:
+    api_key = api_key_override or get_google_api_key()
+    if not api_key:
+        return (
+            None,
+            "Missing API key. Set GEMINI_API_KEY in your environment.",
+        )
+
+    endpoint = os.environ.get("GEMINI_API_ENDPOINT", DEFAULT_GEMINI_ENDPOINT)
+    url = f"{endpoint}/{GEMINI_MODEL}:streamGenerateContent?alt=sse"
+    payload = build_google_payload(history, message, system_prompt)
+    try:
+        response = GEMINI_SESSION.post(
+            url,
+            headers={"X-goog-api-key": api_key},
+            json=payload,
+            timeout=30,
+            stream=True,
+        )
+    except requests.RequestException as exc:
+        return None, f"Gemini request failed: {exc}"
+    if response.status_code >= 400:
+        return None, f"Gemini error ({response.status_code}): {response.text}"
+    return iter_gemini_stream(response), None
+
+
 def call_azure_openai(
     message: str,
     history: List[Dict[str, str]],
@@ -369,215 +762,490 @@ def call_azure_openai(
 def parse_model_json(text: str) -> Any:
     if not text:
         return None
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
     cleaned = text.strip()
     if cleaned.startswith("```"):
-        cleaned = cleaned.replace("```json", "").replace("```", "").strip()
+        cleaned = (
+            cleaned.removeprefix("```json")
+            .removeprefix("```")
+            .removesuffix("```")
+            .strip()
+        )
     try:
-        return json.loads(cleaned)
-    except json.JSONDecodeError:
+        return orjson.loads(cleaned)
+    except orjson.JSONDecodeError:
         start = cleaned.find("{")
         end = cleaned.rfind("}")
         if start != -1 and end != -1 and end > start:
             snippet = cleaned[start : end + 1]
             try:
-                return json.loads(snippet)
-            except json.JSONDecodeError:
+                return orjson.loads(snippet)
+            except orjson.JSONDecodeError:
                 return None
     return None
 
 
-def normalize_value(control: Dict[str, Any], value: Any) -> Any:
+TRUE_STRINGS = frozenset(("true", "1", "on", "yes"))
+FALSE_STRINGS = frozenset(("false", "0", "off", "no"))
+CONTAINER_TYPES = (dict, list)
+
+
+def coerce_bool(value: Any) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in TRUE_STRINGS:
+            return True
+        if lowered in FALSE_STRINGS:
+            return False
+        return None
+    if isinstance(value, (int, float)):
+        return bool(value)
+    return None
+
+
+def coerce_int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def coerce_float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def coerce_str(value: Any) -> Optional[str]:
+    if isinstance(value, CONTAINER_TYPES):
+        return None
+    return str(value)
+
+
+VALUE_COERCERS: Dict[str, Normalizer] = {
+    "bool": coerce_bool,
+    "int": coerce_int,
+    "float": coerce_float,
+}
+
+
+def make_normalizer(control: Dict[str, Any]) -> Normalizer:
     value_type = control.get("value_type", "str")
     control_type = control.get("type", "input")
+    coerce = VALUE_COERCERS.get(value_type, coerce_str)
 
-    if value_type == "bool":
-        if isinstance(value, bool):
-            coerced = value
-        elif isinstance(value, str):
-            lowered = value.strip().lower()
-            if lowered in {"true", "1", "on", "yes"}:
-                coerced = True
-            elif lowered in {"false", "0", "off", "no"}:
-                coerced = False
-            else:
+    if control_type == "select":
+        values = frozenset(control.get("values", []))
+
+        def normalize_select(value: Any) -> Any:
+            coerced = coerce(value)
+            if coerced is None or coerced not in values:
                 return None
-        elif isinstance(value, (int, float)):
-            coerced = bool(value)
-        else:
-            return None
-    elif value_type == "int":
-        try:
-            coerced = int(value)
-        except (TypeError, ValueError):
-            return None
-    elif value_type == "float":
-        try:
-            coerced = float(value)
-        except (TypeError, ValueError):
-            return None
-    else:
-        if isinstance(value, (dict, list)):
-            return None
-        coerced = str(value)
+            return coerced
 
-    if control_type == "select":
-        values = control.get("values", [])
-        if coerced not in values:
-            return None
+        return normalize_select
 
     if control_type == "slider":
         min_value = control.get("min")
         max_value = control.get("max")
         step = control.get("step") or 1
-        if isinstance(coerced, (int, float)):
+        base = 0 if min_value is None else min_value
+        round_to_int = value_type == "int"
+
+        def normalize_slider(value: Any) -> Any:
+            coerced = coerce(value)
+            if not isinstance(coerced, (int, float)):
+                return coerced
             if min_value is not None:
                 coerced = max(min_value, coerced)
             if max_value is not None:
                 coerced = min(max_value, coerced)
-            if min_value is None:
-                min_value = 0
-            steps = round((coerced - min_value) / step)
-            coerced = min_value + steps * step
-            if value_type == "int":
+            coerced = base + round((coerced - base) / step) * step
+            if round_to_int:
                 coerced = int(round(coerced))
+            return coerced
+
+        return normalize_slider
+
+    return coerce
+
+
+def convert_f_to_c(value: Any) -> Any:
+    return (value - 32) * 5 / 9
+
+
+def convert_mph_to_kph(value: Any) -> Any:
+    return value * 1.60934
+
+
+CONVERSIONS: Dict[str, Converter] = {
+    "f_to_c": convert_f_to_c,
+    "mph_to_kph": convert_mph_to_kph,
+}
+
+
+def make_converter(control: Dict[str, Any]) -> Optional[Converter]:
+    convert = CONVERSIONS.get(control.get("conversion"))
+    if convert is None or control.get("value_type") != "int":
+        return convert
 
-    return coerced
+    def convert_to_int(value: Any) -> Any:
+        converted = convert(value)
+        if isinstance(converted, float):
+            converted = int(round(converted))
+        return converted
+
+    return convert_to_int
 
 
-def apply_conversion(control: Dict[str, Any], value: Any) -> Any:
-    conversion = control.get("conversion")
-    if conversion == "f_to_c":
-        return (value - 32) * 5 / 9
-    if conversion == "mph_to_kph":
-        return value * 1.60934
-    return value
+class ControlSpec:
+    __slots__ = ("normalize", "convert", "target_parents", "target_key")
 
+    def __init__(self, path: str, control: Dict[str, Any]) -> None:
+        maps_to = control.get("maps_to")
+        target_path = maps_to if isinstance(maps_to, str) and maps_to else path
+        self.normalize: Normalizer = make_normalizer(control)
+        self.convert: Optional[Converter] = make_converter(control)
+        self.target_parents, self.target_key = split_path(target_path)
 
-def flatten_update(payload: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+
+def flatten_update(payload: Dict[str, Any]) -> Dict[str, Any]:
+    if not any(type(value) is dict for value in payload.values()):
+        return payload
     updates: Dict[str, Any] = {}
-    for key, value in payload.items():
-        path = f"{prefix}.{key}" if prefix else key
-        if isinstance(value, dict):
-            updates.update(flatten_update(value, path))
-        else:
+    stack: List[Tuple[str, Iterator[Tuple[str, Any]]]] = [
+        ("", iter(payload.items()))
+    ]
+    while stack:
+        prefix, items = stack[-1]
+        for key, value in items:
+            path = prefix + key
+            if type(value) is dict:
+                stack.append((path + ".", iter(value.items())))
+                break
             updates[path] = value
+        else:
+            stack.pop()
     return updates
 
 
-def set_in_state(state: Dict[str, Any], path: str, value: Any) -> None:
-    parts = path.split(".")
+def set_in_state(
+    state: Dict[str, Any], parents: Tuple[str, ...], key: str, value: Any
+) -> None:
     current: Dict[str, Any] = state
-    for part in parts[:-1]:
-        if part not in current or not isinstance(current[part], dict):
-            current[part] = {}
-        current = current[part]
-    current[parts[-1]] = value
+    for part in parents:
+        child = current.get(part)
+        if not isinstance(child, dict):
+            child = current[part] = {}
+        current = child
+    current[key] = value
 
 
-def delete_in_state(state: Dict[str, Any], path: str) -> bool:
-    parts = path.split(".")
+def delete_in_state(
+    state: Dict[str, Any], parents: Tuple[str, ...], key: str
+) -> bool:
     current: Dict[str, Any] = state
-    for part in parts[:-1]:
-        if part not in current or not isinstance(current[part], dict):
+    for part in parents:
+        child = current.get(part)
+        if not isinstance(child, dict):
             return False
-        current = current[part]
-    if parts[-1] in current:
-        del current[parts[-1]]
+        current = child
+    if key in current:
+        del current[key]
         return True
     return False
 
 
 def prune_mapped_state_entries(
-    state: Dict[str, Any], controls: Dict[str, Any]
+    state: Dict[str, Any], mapped_paths: List[PathParts]
 ) -> bool:
     changed = False
-    for control in controls.get("controls", []):
-        path = control.get("path")
-        maps_to = control.get("maps_to")
-        if path and maps_to:
-            changed = delete_in_state(state, path) or changed
+    for parents, key in mapped_paths:
+        changed = delete_in_state(state, parents, key) or changed
     return changed
 
 
 def apply_update(state: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
     updates = flatten_update(update)
-    for path, value in updates.items():
-        control = CONTROL_MAP.get(path)
-        if not control:
-            continue
-        normalized = normalize_value(control, value)
-        if normalized is None:
-            continue
-        converted = apply_conversion(control, normalized)
-        if control.get("value_type") == "int" and isinstance(converted, float):
-            converted = int(round(converted))
-        target_path = control.get("maps_to", path)
-        set_in_state(state, target_path, converted)
-    prune_mapped_state_entries(state, CONTROLS)
-    write_json(STATE_PATH, state)
+    registry = CONTROL_REGISTRY
+    changed = False
+    with STATE_LOCK:
+        for path, value in updates.items():
+            spec = registry.specs.get(path)
+            if spec is None:
+                continue
+            normalized = spec.normalize(value)
+            if normalized is None:
+                continue
+            if spec.convert is not None:
+                normalized = spec.convert(normalized)
+            set_in_state(state, spec.target_parents, spec.target_key, normalized)
+            changed = True
+        if prune_mapped_state_entries(state, registry.mapped_paths):
+            changed = True
+        if changed:
+            mark_state_changed()
     return state
 
 
-CONTROLS = load_controls()
-CONTROL_MAP = build_control_map(CONTROLS)
+CONTROL_REGISTRY = ControlRegistry(get_controls_stamp())
 
 
-def build_default_telemetry_state() -> Dict[str, float]:
-    return {
-        "last_ts": time.time(),
-        "trip_km": 12.4,
-        "odometer_km": 18420.7,
-        "fuel_level_pct": 72.0,
-    }
+class TelemetryState:
+    __slots__ = ("last_ts", "trip_km", "odometer_km", "fuel_level_pct")
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.last_ts = time.time()
+        self.trip_km = 12.4
+        self.odometer_km = 18420.7
+        self.fuel_level_pct = 72.0
 
 
 def reset_telemetry_state() -> None:
-    TELEMETRY_STATE.clear()
-    TELEMETRY_STATE.update(build_default_telemetry_state())
+    TELEMETRY_STATE.reset()
 
 
 STATE = load_state()
-if prune_mapped_state_entries(STATE, CONTROLS):
-    write_json(STATE_PATH, STATE)
-TELEMETRY_STATE = build_default_telemetry_state()
+TELEMETRY_STATE = TelemetryState()
+OUTSIDE_TEMP_PERIOD = 2 * math.pi * 900.0
+OUTSIDE_TEMP_WAVE = tuple(
+    math.sin(second / 900.0) for second in range(math.ceil(OUTSIDE_TEMP_PERIOD))
+)
+WEEKDAY_NAMES = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTH_NAMES = (
+    "Jan",
+    "Feb",
+    "Mar",
+    "Apr",
+    "May",
+    "Jun",
+    "Jul",
+    "Aug",
+    "Sep",
+    "Oct",
+    "Nov",
+    "Dec",
+)
+_CLOCK_CACHE: Dict[str, Any] = {"minute": -1, "time": "", "date": ""}
+atexit.register(flush_state)
+threading.Thread(target=run_state_flusher, name="state-flusher", daemon=True).start()
 
 
-def compute_telemetry(state: Dict[str, Any]) -> Dict[str, Any]:
-    now = time.time()
-    last_ts = TELEMETRY_STATE.get("last_ts", now)
+@njit(
+    "UniTuple(float64, 5)(float64, float64, float64, float64, float64, float64)",
+    cache=True,
+    fastmath=True,
+)
+def telemetry_kernel(
+    now: float,
+    last_ts: float,
+    trip_km: float,
+    odometer_km: float,
+    fuel_level_pct: float,
+    speed_kph: float,
+) -> Tuple[float, float, float, float, float]:
     dt = max(0.0, now - last_ts)
-
-    speed_kph = float(state.get("tacc", {}).get("car_speed_kph", 0))
     distance_km = speed_kph * dt / 3600.0
-
-    TELEMETRY_STATE["trip_km"] = TELEMETRY_STATE.get("trip_km", 0.0) + distance_km
-    TELEMETRY_STATE["odometer_km"] = (
-        TELEMETRY_STATE.get("odometer_km", 0.0) + distance_km
+    fuel_level = max(0.0, fuel_level_pct - distance_km * 0.25)
+    engine_temp_c = 70 + min(speed_kph, 120.0) * 0.25
+    range_km = fuel_level / 100.0 * 520
+    return (
+        trip_km + distance_km,
+        odometer_km + distance_km,
+        fuel_level,
+        engine_temp_c,
+        range_km,
     )
 
-    fuel_level = TELEMETRY_STATE.get("fuel_level_pct", 70.0)
-    fuel_level = max(0.0, fuel_level - distance_km * 0.25)
-    TELEMETRY_STATE["fuel_level_pct"] = fuel_level
 
-    outside_temp_c = 18 + 6 * math.sin(now / 900.0)
-    engine_temp_c = 70 + min(speed_kph, 120) * 0.25
-    range_km = fuel_level / 100.0 * 520
+def format_clock(now: float) -> Tuple[str, str]:
+    minute = int(now // 60)
+    if minute != _CLOCK_CACHE["minute"]:
+        local = time.localtime(now)
+        _CLOCK_CACHE["time"] = f"{local.tm_hour:02d}:{local.tm_min:02d}"
+        _CLOCK_CACHE["date"] = (
+            f"{WEEKDAY_NAMES[local.tm_wday]} {MONTH_NAMES[local.tm_mon - 1]} "
+            f"{local.tm_mday:02d}"
+        )
+        _CLOCK_CACHE["minute"] = minute
+    return _CLOCK_CACHE["time"], _CLOCK_CACHE["date"]
 
-    TELEMETRY_STATE["last_ts"] = now
 
+def compute_telemetry(state: Dict[str, Any]) -> Dict[str, Any]:
+    now = time.time()
+    speed_kph = float(state.get("tacc", {}).get("car_speed_kph", 0))
+    (
+        trip_km,
+        odometer_km,
+        fuel_level,
+        engine_temp_c,
+        range_km,
+    ) = telemetry_kernel(
+        now,
+        TELEMETRY_STATE.last_ts,
+        TELEMETRY_STATE.trip_km,
+        TELEMETRY_STATE.odometer_km,
+        TELEMETRY_STATE.fuel_level_pct,
+        speed_kph,
+    )
+    TELEMETRY_STATE.trip_km = trip_km
+    TELEMETRY_STATE.odometer_km = odometer_km
+    TELEMETRY_STATE.fuel_level_pct = fuel_level
+    TELEMETRY_STATE.last_ts = now
+    outside_temp_c = 18 + 6 * OUTSIDE_TEMP_WAVE[int(now % OUTSIDE_TEMP_PERIOD)]
+
+    clock_time, clock_date = format_clock(now)
     return {
         "timestamp": now,
-        "clock_time": datetime.now().strftime("%H:%M"),
-        "clock_date": datetime.now().strftime("%a %b %d"),
+        "clock_time": clock_time,
+        "clock_date": clock_date,
         "outside_temp_c": round(outside_temp_c, 1),
         "engine_temp_c": round(engine_temp_c, 1),
         "range_km": round(range_km, 0),
         "fuel_level_pct": round(fuel_level, 1),
-        "trip_km": round(TELEMETRY_STATE["trip_km"], 1),
-        "odometer_km": round(TELEMETRY_STATE["odometer_km"], 1),
+        "trip_km": round(trip_km, 1),
+        "odometer_km": round(odometer_km, 1),
     }
 
 
+def build_assistant_result(
+    response_text: str, provider: str
+) -> Tuple[Dict[str, Any], int]:
+    parsed = parse_model_json(response_text)
+    if not isinstance(parsed, dict):
+        return {"error": "Model response was not valid JSON."}, 502
+
+    reply = parsed.get("reply")
+    if not isinstance(reply, str) or not reply.strip():
+        reply = "I can help with driving, comfort, or infotainment settings. What would you like to adjust?"
+
+    updates = parsed.get("updates")
+    if not isinstance(updates, dict):
+        updates = {}
+
+    if updates:
+        updated_state = apply_update(STATE, updates)
+    else:
+        updated_state = STATE
+
+    return (
+        {
+            "reply": reply.strip(),
+            "updates": updates,
+            "state": updated_state,
+            "provider": provider,
+        },
+        200,
+    )
+
+
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+REPLY_VALUE_START = re.compile(r'"reply"\s*:\s*"')
+
+
+class ReplyTextExtractor:
+    __slots__ = ("buffer", "start", "scan", "emitted", "closed")
+
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.start = -1
+        self.scan = -1
+        self.emitted = 0
+        self.closed = False
+
+    def feed(self, text: str) -> str:
+        self.buffer += text
+        if self.closed:
+            return ""
+        buffer = self.buffer
+        if self.start < 0:
+            match = REPLY_VALUE_START.search(buffer)
+            if match is None:
+                return ""
+            self.start = self.scan = match.end()
+        pos = self.scan
+        length = len(buffer)
+        while pos < length:
+            char = buffer[pos]
+            if char == '"':
+                self.closed = True
+                break
+            if char == "\\":
+                width = 6 if buffer[pos + 1 : pos + 2] == "u" else 2
+                if pos + width > length:
+                    break
+                pos += width
+            else:
+                pos += 1
+        self.scan = pos
+        try:
+            decoded = orjson.loads(f'"{buffer[self.start:pos]}"')
+        except orjson.JSONDecodeError:
+            return ""
+        delta = decoded[self.emitted :]
+        self.emitted = len(decoded)
+        return delta
+
+
+def stream_assistant_events(chunks: Iterator[str], provider: str) -> Iterator[str]:
+    extractor = ReplyTextExtractor()
+    try:
+        for text in chunks:
+            delta = extractor.feed(text)
+            if delta:
+                yield format_sse("delta", {"text": delta})
+    except requests.RequestException as exc:
+        yield format_sse("error", {"error": f"Gemini request failed: {exc}"})
+        return
+    result, status = build_assistant_result(extractor.buffer, provider)
+    yield format_sse("done" if status == 200 else "error", result)
+
+
+def enable_profiling() -> None:
+    try:
+        from pyinstrument import Profiler
+        from pyinstrument.renderers import SpeedscopeRenderer
+    except ImportError as exc:
+        app.logger.warning(
+            "PROFILE is set but pyinstrument is not installed: %s", exc
+        )
+        return
+
+    PROFILE_DIR.mkdir(exist_ok=True)
+
+    @app.before_request
+    def start_profiler() -> None:
+        g.profiler = Profiler()
+        g.profiler.start()
+
+    @app.after_request
+    def stop_profiler(response: Response) -> Response:
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return response
+        profiler.stop()
+        endpoint = (request.endpoint or "unknown").replace(".", "_")
+        output_path = PROFILE_DIR / f"{time.time_ns()}-{endpoint}.speedscope.json"
+        output_path.write_text(profiler.output(renderer=SpeedscopeRenderer()))
+        return response
+
+
+if os.environ.get("PROFILE"):
+    enable_profiling()
+
+
 @app.route("/")
 def index() -> str:
     return render_template("index.html")
@@ -585,18 +1253,21 @@ def index() -> str:
 
 @app.get("/api/controls")
 def get_controls():
-    refresh_controls()
-    return jsonify(CONTROLS)
+    registry = refresh_controls()
+    return json_response_with_etag(registry.controls_json, registry.etag)
 
 
 @app.get("/api/state")
 def get_state():
-    return jsonify(STATE)
+    etag = get_state_etag()
+    return json_response_with_etag(get_state_json(), etag)
 
 
 @app.get("/api/telemetry")
 def get_telemetry():
-    return jsonify(compute_telemetry(STATE))
+    return Response(
+        orjson.dumps(compute_telemetry(STATE)), mimetype="application/json"
+    )
 
 
 @app.post("/api/state")
@@ -604,32 +1275,31 @@ def update_state():
     refresh_controls()
     if not authorize_request():
         return unauthorized_response()
-    payload = request.get_json(silent=True) or {}
-    if not isinstance(payload, dict):
-        payload = {}
-    updated = apply_update(STATE, payload)
-    return jsonify(updated)
+    payload = read_json_payload()
+    apply_update(STATE, payload)
+    return Response(get_state_json(), mimetype="application/json")
 
 
 @app.post("/api/reset")
 def reset_state():
-    global STATE
     if not authorize_request():
         return unauthorized_response()
-    STATE = deepcopy(DEFAULT_STATE)
-    write_json(STATE_PATH, STATE)
+    with STATE_LOCK:
+        fresh = copy_dict_tree(DEFAULT_STATE)
+        STATE.update(fresh)
+        for key in [key for key in STATE if key not in fresh]:
+            del STATE[key]
+        mark_state_changed()
     reset_telemetry_state()
-    return jsonify(STATE)
+    return Response(DEFAULT_STATE_JSON, mimetype="application/json")
 
 
 @app.post("/api/assistant")
 def assistant():
-    refresh_controls()
+    registry = refresh_controls()
     if not authorize_request():
         return unauthorized_response()
-    payload = request.get_json(silent=True) or {}
-    if not isinstance(payload, dict):
-        payload = {}
+    payload = read_json_payload()
 
     message = payload.get("message")
     if not isinstance(message, str) or not message.strip():
@@ -657,7 +1327,18 @@ def assistant():
         response.headers["Retry-After"] = str(retry_after)
         return response, 429
 
-    system_prompt = build_assistant_system_prompt(CONTROLS, STATE)
+    system_prompt = build_assistant_system_prompt(registry, STATE)
+    if provider == "google" and payload.get("stream") is True:
+        chunks, error = stream_google_gemini(
+            message, history, system_prompt, api_key_override
+        )
+        if error or chunks is None:
+            return jsonify({"error": error}), 502
+        return Response(
+            stream_with_context(stream_assistant_events(chunks, provider)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
     if provider == "google":
         response_text, error = call_google_gemini(
             message, history, system_prompt, api_key_override
@@ -672,33 +1353,16 @@ def assistant():
     if error:
         return jsonify({"error": error}), 502
 
-    parsed = parse_model_json(response_text or "")
-    if not isinstance(parsed, dict):
-        return jsonify({"error": "Model response was not valid JSON."}), 502
-
-    reply = parsed.get("reply")
-    if not isinstance(reply, str) or not reply.strip():
-        reply = "I can help with driving, comfort, or infotainment settings. What would you like to adjust?"
-
-    updates = parsed.get("updates")
-    if not isinstance(updates, dict):
-        updates = {}
-
-    if updates:
-        updated_state = apply_update(STATE, updates)
-    else:
-        updated_state = STATE
-
-    return jsonify(
-        {
-            "reply": reply.strip(),
-            "updates": updates,
-            "state": updated_state,
-            "provider": provider,
-        }
-    )
+    result, status = build_assistant_result(response_text or "", provider)
+    return jsonify(result), status
 
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "5000"))
-    app.run(host="0.0.0.0", port=port, debug=False)
+    try:
+        from waitress import serve
+    except ImportError:
+        app.run(host="0.0.0.0", port=port, debug=False, threaded=True)
+    else:
+        threads = int(os.environ.get("WAITRESS_THREADS", "32"))
+        serve(app, host="0.0.0.0", port=port, threads=threads)
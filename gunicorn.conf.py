@@ -0,0 +1,10 @@
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Dashboard state lives in process memory, so scale with threads rather than
+# worker processes. A blocking Gemini/Azure call then only occupies one thread.
+workers = 1
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+timeout = 60
@@ -124,22 +124,6 @@ function deriveValueFromState(control, state) {
   return source;
 }
 
-function buildUpdate(path, value) {
-  const parts = path.split(".");
-  const payload = {};
-  let current = payload;
-  for (let i = 0; i < parts.length; i += 1) {
-    const key = parts[i];
-    if (i === parts.length - 1) {
-      current[key] = value;
-    } else {
-      current[key] = {};
-      current = current[key];
-    }
-  }
-  return payload;
-}
-
 function coerceForSend(control, value) {
   if (!control) {
     return value;
@@ -522,7 +506,7 @@ function initAssistant() {
 }
 
 async function sendUpdate(control, rawValue) {
-  const payload = buildUpdate(control.path, coerceForSend(control, rawValue));
+  const payload = { [control.path]: coerceForSend(control, rawValue) };
   try {
     const response = await fetch("/api/state", {
       method: "POST",